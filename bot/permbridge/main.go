@@ -19,18 +19,31 @@ package main
 
 import (
 	"bufio"
+	"bytes"
 	"encoding/json"
+	"errors"
 	"fmt"
+	"io"
+	"io/fs"
 	"os"
 	"path/filepath"
+	"sync"
 )
 
 const (
 	fifoRequestName  = "permission_request.fifo"
 	fifoResponseName = "permission_response.fifo"
 	toolName         = "request_permission"
+
+	// maxStdinLine caps a single JSON-RPC message from claude, so a runaway
+	// or unterminated line fails cleanly instead of growing memory without
+	// bound.
+	maxStdinLine = 4 * 1024 * 1024
 )
 
+// errLineTooLong is returned by readLine when a line exceeds its limit.
+var errLineTooLong = errors.New("line too long")
+
 // jsonrpcResponse models the shape of JSON-RPC 2.0 responses we write back
 // on stdout. `Result` and `Error` are both json.RawMessage so the caller
 // can marshal arbitrary structures without extra plumbing.
@@ -59,6 +72,36 @@ func logf(format string, args ...any) {
 	fmt.Fprintf(os.Stderr, "[permbridge] "+format+"\n", args...)
 }
 
+// debug enables per-message trace logging (CLOD_MCP_DEBUG=1). It's off by
+// default so the request path does no stderr I/O; errors are always
+// logged via logf.
+var debug = os.Getenv("CLOD_MCP_DEBUG") == "1"
+
+func debugf(format string, args ...any) {
+	if debug {
+		logf(format, args...)
+	}
+}
+
+// stdout buffers responses so a burst of requests read in one go (claude
+// sends initialize, notifications/initialized and tools/list back to back)
+// is answered with a single write. serve flushes it whenever no complete
+// line is left in stdin's buffer, and runToolCalls flushes after each
+// response. stdoutMu guards it because runToolCalls writes concurrently
+// with the read loop.
+var (
+	stdoutMu sync.Mutex
+	stdout   = bufio.NewWriterSize(os.Stdout, 64*1024)
+)
+
+func flushStdout() {
+	stdoutMu.Lock()
+	defer stdoutMu.Unlock()
+	if err := stdout.Flush(); err != nil {
+		logf("flush stdout: %v", err)
+	}
+}
+
 func writeResponse(r jsonrpcResponse) {
 	r.JSONRPC = "2.0"
 	enc, err := json.Marshal(r)
@@ -66,61 +109,97 @@ func writeResponse(r jsonrpcResponse) {
 		logf("marshal response: %v", err)
 		return
 	}
-	// MCP requires one JSON document per line on stdout.
-	fmt.Println(string(enc))
-}
-
-func respondResult(id json.RawMessage, result any) {
-	raw, err := json.Marshal(result)
-	if err != nil {
-		logf("marshal result: %v", err)
-		return
+	// MCP requires one JSON document per line on stdout. Write the encoded
+	// bytes directly rather than round-tripping through a string.
+	stdoutMu.Lock()
+	defer stdoutMu.Unlock()
+	if _, err := stdout.Write(append(enc, '\n')); err != nil {
+		logf("write response: %v", err)
 	}
-	writeResponse(jsonrpcResponse{ID: id, Result: raw})
 }
 
 func respondError(id json.RawMessage, code int, message string) {
 	writeResponse(jsonrpcResponse{ID: id, Error: &jsonrpcError{Code: code, Message: message}})
 }
 
+// appendRawResult appends a complete JSON-RPC result line for an
+// already-encoded result to dst. The envelope is fixed, so we splice id
+// and result into it directly instead of marshaling a jsonrpcResponse,
+// which would also re-validate and compact both RawMessages. Field order
+// and the omitted-empty id match writeResponse.
+func appendRawResult(dst []byte, id, result json.RawMessage) []byte {
+	dst = append(dst, `{"jsonrpc":"2.0"`...)
+	if len(id) > 0 {
+		dst = append(dst, `,"id":`...)
+		dst = append(dst, id...)
+	}
+	dst = append(dst, `,"result":`...)
+	dst = append(dst, result...)
+	return append(dst, "}\n"...)
+}
+
+func respondResult(id, result json.RawMessage) {
+	stdoutMu.Lock()
+	defer stdoutMu.Unlock()
+	if _, err := stdout.Write(appendRawResult(stdout.AvailableBuffer(), id, result)); err != nil {
+		logf("write response: %v", err)
+	}
+}
+
+// mustMarshal encodes a static value at init time. Only used for the
+// constant results below, so a failure is a programming error.
+func mustMarshal(v any) json.RawMessage {
+	raw, err := json.Marshal(v)
+	if err != nil {
+		panic(err)
+	}
+	return raw
+}
+
 // initializeResult mirrors what the Python bridge advertised; claude is
 // tolerant of minor variation but we keep the exact shape for parity.
-func handleInitialize(id json.RawMessage) {
-	respondResult(id, map[string]any{
-		"protocolVersion": "2024-11-05",
-		"capabilities": map[string]any{
-			"tools": map[string]any{},
-		},
-		"serverInfo": map[string]any{
-			"name":    "permission-mcp",
-			"version": "1.0.0",
-		},
-	})
-}
+// It and toolsListResult never change, so they're encoded once at startup
+// and only the request id is spliced in per call.
+var initializeResult = mustMarshal(map[string]any{
+	"protocolVersion": "2024-11-05",
+	"capabilities": map[string]any{
+		"tools": map[string]any{},
+	},
+	"serverInfo": map[string]any{
+		"name":    "permission-mcp",
+		"version": "1.0.0",
+	},
+})
 
-func handleToolsList(id json.RawMessage) {
-	respondResult(id, map[string]any{
-		"tools": []map[string]any{
-			{
-				"name":        toolName,
-				"description": "Request permission from the user for a tool operation",
-				"inputSchema": map[string]any{
-					"type": "object",
-					"properties": map[string]any{
-						"tool_name": map[string]any{
-							"type":        "string",
-							"description": "Name of the tool requesting permission",
-						},
-						"input": map[string]any{
-							"type":        "object",
-							"description": "Input parameters for the tool",
-						},
+var toolsListResult = mustMarshal(map[string]any{
+	"tools": []map[string]any{
+		{
+			"name":        toolName,
+			"description": "Request permission from the user for a tool operation",
+			"inputSchema": map[string]any{
+				"type": "object",
+				"properties": map[string]any{
+					"tool_name": map[string]any{
+						"type":        "string",
+						"description": "Name of the tool requesting permission",
+					},
+					"input": map[string]any{
+						"type":        "object",
+						"description": "Input parameters for the tool",
 					},
-					"required": []string{"tool_name", "input"},
 				},
+				"required": []string{"tool_name", "input"},
 			},
 		},
-	})
+	},
+})
+
+func handleInitialize(id json.RawMessage) {
+	respondResult(id, initializeResult)
+}
+
+func handleToolsList(id json.RawMessage) {
+	respondResult(id, toolsListResult)
 }
 
 // toolsCallParams unpacks just the fields we use.
@@ -134,43 +213,170 @@ type permissionArguments struct {
 	Input    json.RawMessage `json:"input"`
 }
 
+// bridgeRequest is the wire format permbridge writes on the request FIFO;
+// the bot decodes it as PermissionRequest. A fixed struct encodes without
+// the per-call map allocation and key sort a map[string]any would cost.
+type bridgeRequest struct {
+	ToolName  string          `json:"tool_name"`
+	ToolInput json.RawMessage `json:"tool_input"`
+}
+
 // botResponse is the wire format the bot writes back on the response FIFO.
 type botResponse struct {
 	Behavior string `json:"behavior"`
 	Message  string `json:"message"`
 }
 
-// denyResult formats a tool result that signals deny.
-func denyResult(message string) map[string]any {
-	payload, _ := json.Marshal(map[string]any{
-		"behavior": "deny",
-		"message":  message,
-	})
-	return map[string]any{
-		"content": []map[string]any{
-			{"type": "text", "text": string(payload)},
-		},
-	}
+// textResult wraps payload as the single text content block of a tool
+// result. payload is quoted once and spliced into the fixed envelope
+// rather than marshaling a nested map around it.
+func textResult(payload []byte) json.RawMessage {
+	text, _ := json.Marshal(string(payload))
+	out := make([]byte, 0, len(text)+48)
+	out = append(out, `{"content":[{"type":"text","text":`...)
+	out = append(out, text...)
+	return append(out, "}]}"...)
+}
+
+// denyResult formats a tool result that signals deny. The payload shape
+// is fixed, so it's assembled directly with only the message needing
+// encoding; the field order matches what json.Marshal produced from the
+// equivalent map.
+func denyResult(message string) json.RawMessage {
+	msg, _ := json.Marshal(message)
+	payload := make([]byte, 0, len(msg)+32)
+	payload = append(payload, `{"behavior":"deny","message":`...)
+	payload = append(payload, msg...)
+	return textResult(append(payload, '}'))
 }
 
 // allowResult formats a tool result that signals allow and echoes the
 // original input back as updatedInput (claude requires this field for the
-// allow branch).
-func allowResult(input json.RawMessage) map[string]any {
+// allow branch). input is spliced in as-is: it's a RawMessage taken from
+// the already-validated tools/call arguments.
+func allowResult(input json.RawMessage) json.RawMessage {
 	if len(input) == 0 {
 		input = json.RawMessage("{}")
 	}
-	payload, _ := json.Marshal(map[string]any{
-		"behavior":     "allow",
-		"updatedInput": json.RawMessage(input),
-	})
-	return map[string]any{
-		"content": []map[string]any{
-			{"type": "text", "text": string(payload)},
-		},
+	payload := make([]byte, 0, len(input)+36)
+	payload = append(payload, `{"behavior":"allow","updatedInput":`...)
+	payload = append(payload, input...)
+	return textResult(append(payload, '}'))
+}
+
+// fifoConn holds the request/response FIFOs open across tools/call
+// invocations so each permission prompt costs one write and one read
+// instead of two blocking open/close pairs.
+//
+// The response FIFO is opened O_RDWR (well-defined on Linux, which is the
+// only target this binary is built for). Holding a write reference of our
+// own means a read never sees EOF when the bot closes its end after each
+// response; it just blocks until the next line arrives. It also makes the
+// open non-blocking, so only the request side waits for the bot.
+type fifoConn struct {
+	mu   sync.Mutex
+	req  *os.File
+	resp *os.File
+	sc   *bufio.Scanner
+
+	// wbuf holds the encoded request line. It's reused across calls so
+	// each request is encoded in place and handed to a single write(2)
+	// without a per-call allocation or an append copy for the newline.
+	wbuf bytes.Buffer
+	enc  *json.Encoder
+}
+
+// bridge is the process-wide FIFO connection used by handleToolCall.
+var bridge fifoConn
+
+// open lazily opens both FIFOs. The caller must hold c.mu.
+func (c *fifoConn) open(requestFIFO, responseFIFO string) error {
+	if c.req != nil {
+		return nil
+	}
+	// Opening a FIFO for write blocks until a reader is present (the bot).
+	// There's no separate existence probe: the open itself reports ENOENT
+	// when the bot has torn the runtime dir down.
+	req, err := os.OpenFile(requestFIFO, os.O_WRONLY, 0)
+	if err != nil {
+		return fmt.Errorf("open request FIFO: %w", err)
+	}
+	resp, err := os.OpenFile(responseFIFO, os.O_RDWR, 0)
+	if err != nil {
+		_ = req.Close()
+		return fmt.Errorf("open response FIFO: %w", err)
+	}
+	c.req = req
+	c.resp = resp
+	// One scanner for the life of the connection: its buffer is reused
+	// across replies, and the 1 MiB cap keeps a runaway line from the bot
+	// failing cleanly instead of growing without bound.
+	c.sc = bufio.NewScanner(resp)
+	c.sc.Buffer(make([]byte, 0, 64*1024), 1024*1024)
+	return nil
+}
+
+// reset closes both FIFOs so the next roundTrip reopens them. Used after
+// any I/O error, since a half-finished exchange would otherwise leave a
+// stale response queued for the next request. The caller must hold c.mu.
+func (c *fifoConn) reset() {
+	if c.req != nil {
+		_ = c.req.Close()
+	}
+	if c.resp != nil {
+		_ = c.resp.Close()
 	}
+	c.req, c.resp, c.sc = nil, nil, nil
 }
 
+// roundTrip encodes req as one JSON line, sends it to the bot and returns
+// its one-line reply. Only one exchange may be in flight, since the bot's
+// replies carry no id; runToolCalls is the only caller, and c.mu makes the
+// invariant explicit.
+func (c *fifoConn) roundTrip(requestFIFO, responseFIFO string, req *bridgeRequest) ([]byte, error) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	if c.enc == nil {
+		c.enc = json.NewEncoder(&c.wbuf)
+	}
+	c.wbuf.Reset()
+	// Encode terminates the document with '\n', which is exactly the
+	// line framing the bot's scanner expects.
+	if err := c.enc.Encode(req); err != nil {
+		return nil, fmt.Errorf("encode request: %w", err)
+	}
+
+	if err := c.open(requestFIFO, responseFIFO); err != nil {
+		return nil, err
+	}
+	if _, err := c.req.Write(c.wbuf.Bytes()); err != nil {
+		c.reset()
+		return nil, fmt.Errorf("write request FIFO: %w", err)
+	}
+	if !c.sc.Scan() {
+		err := c.sc.Err()
+		if err == nil {
+			err = io.ErrUnexpectedEOF
+		}
+		c.reset()
+		return nil, fmt.Errorf("read response FIFO: %w", err)
+	}
+	return bytes.Clone(c.sc.Bytes()), nil
+}
+
+// fifoPaths resolves the request/response FIFO paths from
+// CLOD_RUNTIME_DIR. The runtime dir can't change for the lifetime of the
+// bridge process, so the env lookup and path joins happen once instead of
+// on every tools/call. Both paths are empty when CLOD_RUNTIME_DIR is unset.
+var fifoPaths = sync.OnceValues(func() (string, string) {
+	runtimeDir := os.Getenv("CLOD_RUNTIME_DIR")
+	if runtimeDir == "" {
+		return "", ""
+	}
+	return filepath.Join(runtimeDir, fifoRequestName), filepath.Join(runtimeDir, fifoResponseName)
+})
+
 func handleToolCall(id json.RawMessage, rawParams json.RawMessage) {
 	var params toolsCallParams
 	if err := json.Unmarshal(rawParams, &params); err != nil {
@@ -187,126 +393,177 @@ func handleToolCall(id json.RawMessage, rawParams json.RawMessage) {
 		return
 	}
 
-	runtimeDir := os.Getenv("CLOD_RUNTIME_DIR")
-	if runtimeDir == "" {
+	requestFIFO, responseFIFO := fifoPaths()
+	if requestFIFO == "" {
 		logf("CLOD_RUNTIME_DIR not set; defaulting to deny")
 		respondResult(id, denyResult("Permission system not available (CLOD_RUNTIME_DIR unset)"))
 		return
 	}
-	requestFIFO := filepath.Join(runtimeDir, fifoRequestName)
-	responseFIFO := filepath.Join(runtimeDir, fifoResponseName)
-	if _, err := os.Stat(requestFIFO); err != nil {
-		logf("request FIFO missing at %s: %v", requestFIFO, err)
-		respondResult(id, denyResult("Permission system not available"))
-		return
-	}
-	if _, err := os.Stat(responseFIFO); err != nil {
-		logf("response FIFO missing at %s: %v", responseFIFO, err)
-		respondResult(id, denyResult("Permission system not available"))
-		return
-	}
 
-	logf("permission requested for tool: %s", args.ToolName)
+	debugf("permission requested for tool: %s", args.ToolName)
 
 	// Build the request the bot expects and send it over the request FIFO.
-	// Opening a FIFO for write blocks until a reader is present (the bot);
-	// same for the response FIFO.
-	reqPayload, err := json.Marshal(map[string]any{
-		"tool_name":  args.ToolName,
-		"tool_input": json.RawMessage(args.Input),
+	line, err := bridge.roundTrip(requestFIFO, responseFIFO, &bridgeRequest{
+		ToolName:  args.ToolName,
+		ToolInput: args.Input,
 	})
-	if err != nil {
-		respondResult(id, denyResult(fmt.Sprintf("Marshal request: %v", err)))
-		return
-	}
-
-	reqFile, err := os.OpenFile(requestFIFO, os.O_WRONLY, 0)
-	if err != nil {
-		logf("open request FIFO: %v", err)
-		respondResult(id, denyResult(fmt.Sprintf("Open request FIFO: %v", err)))
-		return
-	}
-	if _, err := reqFile.Write(append(reqPayload, '\n')); err != nil {
-		_ = reqFile.Close()
-		logf("write request FIFO: %v", err)
-		respondResult(id, denyResult(fmt.Sprintf("Write request FIFO: %v", err)))
+	if errors.Is(err, fs.ErrNotExist) {
+		logf("permission FIFO missing: %v", err)
+		respondResult(id, denyResult("Permission system not available"))
 		return
 	}
-	_ = reqFile.Close()
-
-	respFile, err := os.Open(responseFIFO)
 	if err != nil {
-		logf("open response FIFO: %v", err)
-		respondResult(id, denyResult(fmt.Sprintf("Open response FIFO: %v", err)))
+		logf("permission FIFO round trip: %v", err)
+		respondResult(id, denyResult(fmt.Sprintf("Permission system error: %v", err)))
 		return
 	}
-	defer respFile.Close()
 
-	scanner := bufio.NewScanner(respFile)
-	scanner.Buffer(make([]byte, 0, 64*1024), 1024*1024)
-	if !scanner.Scan() {
-		if err := scanner.Err(); err != nil {
-			logf("read response FIFO: %v", err)
-		} else {
-			logf("empty response from bot")
-		}
-		respondResult(id, denyResult("Empty response from permission system"))
-		return
-	}
-	line := scanner.Text()
+	respondResult(id, decisionResult(line, args.Input))
+}
 
+// decisionResult turns the bot's reply line into the tool result for
+// claude. Anything other than an explicit allow is a deny.
+func decisionResult(line []byte, input json.RawMessage) json.RawMessage {
 	var resp botResponse
-	if err := json.Unmarshal([]byte(line), &resp); err != nil {
+	if err := json.Unmarshal(line, &resp); err != nil {
 		logf("parse bot response %q: %v", line, err)
-		respondResult(id, denyResult(fmt.Sprintf("Bad response from permission system: %v", err)))
-		return
+		return denyResult(fmt.Sprintf("Bad response from permission system: %v", err))
 	}
 
-	logf("bot decision: behavior=%s", resp.Behavior)
+	debugf("bot decision: behavior=%s", resp.Behavior)
 
 	if resp.Behavior == "allow" {
-		respondResult(id, allowResult(args.Input))
-		return
+		return allowResult(input)
 	}
 	msg := resp.Message
 	if msg == "" {
 		msg = "Permission denied by user"
 	}
-	respondResult(id, denyResult(msg))
+	return denyResult(msg)
+}
+
+// readLine returns the next line from r without its line terminator. The
+// slice aliases r's buffer when the line fits in it and is only valid
+// until the next read; longer lines are accumulated into a fresh slice,
+// up to limit bytes, past which errLineTooLong is returned. A final line
+// without a trailing newline is returned along with io.EOF.
+func readLine(r *bufio.Reader, limit int) ([]byte, error) {
+	line, err := r.ReadSlice('\n')
+	if err == bufio.ErrBufferFull {
+		long := append([]byte(nil), line...)
+		for err == bufio.ErrBufferFull {
+			if len(long) > limit {
+				return nil, errLineTooLong
+			}
+			line, err = r.ReadSlice('\n')
+			long = append(long, line...)
+		}
+		line = long
+	}
+	line = bytes.TrimRight(line, "\r\n")
+	if len(line) > limit {
+		return nil, errLineTooLong
+	}
+	return line, err
 }
 
 func main() {
 	logf("starting permission MCP bridge")
-	reader := bufio.NewScanner(os.Stdin)
-	reader.Buffer(make([]byte, 0, 64*1024), 4*1024*1024)
-	for reader.Scan() {
-		line := reader.Bytes()
-		if len(line) == 0 {
-			continue
+	done := make(chan struct{})
+	go func() {
+		runToolCalls()
+		close(done)
+	}()
+	serve(os.Stdin)
+	// Answer every tools/call claude already sent before exiting, as the
+	// bridge did when it handled them inline on the read loop.
+	close(toolCalls)
+	<-done
+}
+
+// serve reads JSON-RPC messages from in until EOF and dispatches each one.
+// It reads in large chunks and splits frames out of the buffer, so a burst
+// of messages costs one read(2) and, via the stdout flush below, one
+// write(2).
+func serve(in io.Reader) {
+	reader := bufio.NewReaderSize(in, 64*1024)
+	for {
+		// Flush once no complete line is left in the buffer: the next
+		// readLine would block on stdin, and claude may be waiting on a
+		// reply before it sends the rest of a partial message.
+		if buf, _ := reader.Peek(reader.Buffered()); bytes.IndexByte(buf, '\n') < 0 {
+			flushStdout()
 		}
-		var req jsonrpcRequest
-		if err := json.Unmarshal(line, &req); err != nil {
-			logf("invalid JSON: %v", err)
-			continue
+		line, err := readLine(reader, maxStdinLine)
+		if len(line) > 0 {
+			dispatch(line)
 		}
-		logf("received method: %s", req.Method)
-		switch req.Method {
-		case "initialize":
-			handleInitialize(req.ID)
-		case "notifications/initialized":
-			// no response required
-		case "tools/list":
-			handleToolsList(req.ID)
-		case "tools/call":
-			handleToolCall(req.ID, req.Params)
-		default:
-			logf("unknown method: %s", req.Method)
-			if len(req.ID) > 0 && string(req.ID) != "null" {
-				respondError(req.ID, -32601, fmt.Sprintf("method not found: %s", req.Method))
+		if err != nil {
+			if err != io.EOF {
+				logf("read stdin: %v", err)
 			}
+			break
 		}
 	}
-	if err := reader.Err(); err != nil {
-		logf("stdin scanner: %v", err)
+	flushStdout()
+}
+
+// handlers maps each supported JSON-RPC method to its handler. Every
+// handler takes the same (id, params) pair so dispatch is a single map
+// lookup with no per-method argument plumbing.
+var handlers = map[string]func(id, params json.RawMessage){
+	"initialize":                func(id, _ json.RawMessage) { handleInitialize(id) },
+	"notifications/initialized": func(_, _ json.RawMessage) {}, // no response required
+	"tools/list":                func(id, _ json.RawMessage) { handleToolsList(id) },
+	"tools/call":                startToolCall,
+}
+
+// toolCall is one queued tools/call invocation. id and params are copies
+// made by json.Unmarshal, so they're safe to hand to another goroutine.
+type toolCall struct {
+	id     json.RawMessage
+	params json.RawMessage
+}
+
+// toolCalls feeds runToolCalls. The buffer lets the read loop keep
+// serving other messages while a prompt waits on the user; only a backlog
+// deeper than this would make it wait.
+var toolCalls = make(chan toolCall, 64)
+
+// startToolCall queues a tools/call for runToolCalls. A permission prompt
+// can wait on the user for hours, and running it inline would stall every
+// other message claude sends in the meantime.
+func startToolCall(id, params json.RawMessage) {
+	toolCalls <- toolCall{id: id, params: params}
+}
+
+// runToolCalls handles queued tools/call invocations one at a time on a
+// single long-lived goroutine, so prompts reach the bot (and Slack) in
+// the order claude sent them. Goroutines contending for fifoConn.mu would
+// not preserve that order.
+func runToolCalls() {
+	for call := range toolCalls {
+		handleToolCall(call.id, call.params)
+		flushStdout()
+	}
+}
+
+// dispatch decodes one JSON-RPC message and routes it to its handler.
+// line may alias the stdin buffer; json.Unmarshal copies everything it
+// keeps, including the RawMessage fields.
+func dispatch(line []byte) {
+	var req jsonrpcRequest
+	if err := json.Unmarshal(line, &req); err != nil {
+		logf("invalid JSON: %v", err)
+		return
+	}
+	debugf("received method: %s", req.Method)
+	if handle, ok := handlers[req.Method]; ok {
+		handle(req.ID, req.Params)
+		return
+	}
+	logf("unknown method: %s", req.Method)
+	if len(req.ID) > 0 && string(req.ID) != "null" {
+		respondError(req.ID, -32601, fmt.Sprintf("method not found: %s", req.Method))
 	}
 }
@@ -0,0 +1,325 @@
+package main
+
+import (
+	"bufio"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"io"
+	"os"
+	"path/filepath"
+	"strings"
+	"sync"
+	"syscall"
+	"testing"
+	"time"
+)
+
+// TestAppendRawResult checks that the spliced result envelope is
+// byte-for-byte what writeResponse would have produced by marshaling a
+// jsonrpcResponse, including the omitted id for notifications.
+func TestAppendRawResult(t *testing.T) {
+	cases := []struct {
+		name string
+		id   json.RawMessage
+	}{
+		{"numeric id", json.RawMessage(`1`)},
+		{"string id", json.RawMessage(`"req-7"`)},
+		{"no id", nil},
+	}
+	for _, c := range cases {
+		t.Run(c.name, func(t *testing.T) {
+			for _, result := range []json.RawMessage{initializeResult, toolsListResult} {
+				want, err := json.Marshal(jsonrpcResponse{JSONRPC: "2.0", ID: c.id, Result: result})
+				if err != nil {
+					t.Fatalf("marshal: %v", err)
+				}
+				got := appendRawResult(nil, c.id, result)
+				if string(got) != string(want)+"\n" {
+					t.Errorf("appendRawResult\n got: %s\nwant: %s", got, want)
+				}
+			}
+		})
+	}
+}
+
+// TestTextResult round-trips deny and allow results through a decoder to
+// make sure the hand-spliced envelope is valid JSON carrying the payload
+// verbatim as its single text block.
+func TestTextResult(t *testing.T) {
+	cases := []struct {
+		name   string
+		result json.RawMessage
+		want   string
+	}{
+		{"deny", denyResult(`User "bob" denied permission`), `{"behavior":"deny","message":"User \"bob\" denied permission"}`},
+		{"allow", allowResult(json.RawMessage(`{"command":"ls"}`)), `{"behavior":"allow","updatedInput":{"command":"ls"}}`},
+		{"allow empty input", allowResult(nil), `{"behavior":"allow","updatedInput":{}}`},
+	}
+	for _, c := range cases {
+		t.Run(c.name, func(t *testing.T) {
+			var got struct {
+				Content []struct {
+					Type string `json:"type"`
+					Text string `json:"text"`
+				} `json:"content"`
+			}
+			if err := json.Unmarshal(c.result, &got); err != nil {
+				t.Fatalf("unmarshal %s: %v", c.result, err)
+			}
+			if len(got.Content) != 1 || got.Content[0].Type != "text" {
+				t.Fatalf("unexpected content: %s", c.result)
+			}
+			if got.Content[0].Text != c.want {
+				t.Errorf("text\n got: %s\nwant: %s", got.Content[0].Text, c.want)
+			}
+		})
+	}
+}
+
+// TestReadLine checks framing, the accumulate path for lines longer than
+// the reader's buffer, and the maximum line length.
+func TestReadLine(t *testing.T) {
+	long := strings.Repeat("x", 40)
+	r := bufio.NewReaderSize(strings.NewReader("short\r\n"+long+"\n"+long+"y\ntail"), 16)
+
+	for _, want := range []string{"short", long} {
+		line, err := readLine(r, len(long))
+		if err != nil || string(line) != want {
+			t.Fatalf("readLine = %q, %v; want %q", line, err, want)
+		}
+	}
+	if _, err := readLine(r, len(long)); !errors.Is(err, errLineTooLong) {
+		t.Fatalf("over-long line: err = %v, want errLineTooLong", err)
+	}
+
+	r = bufio.NewReaderSize(strings.NewReader("tail"), 16)
+	if line, err := readLine(r, 10); string(line) != "tail" || err != io.EOF {
+		t.Fatalf("unterminated line = %q, %v; want %q, io.EOF", line, err, "tail")
+	}
+}
+
+// TestServeFlushesBeforePartialLine sends a complete request followed by
+// the start of another in a single write, and expects the first reply
+// before the rest of the second request arrives.
+func TestServeFlushesBeforePartialLine(t *testing.T) {
+	inR, inW := io.Pipe()
+	outR, outW := io.Pipe()
+	saved := stdout
+	stdout = bufio.NewWriterSize(outW, 64*1024)
+	served := make(chan struct{})
+	go func() {
+		serve(inR)
+		close(served)
+	}()
+	t.Cleanup(func() {
+		inW.Close()
+		outR.Close()
+		<-served
+		stdout = saved
+	})
+
+	go inW.Write([]byte(`{"jsonrpc":"2.0","id":1,"method":"tools/list"}` + "\n" + `{"jsonrpc":"2.0",`))
+
+	reply := make(chan string, 1)
+	go func() {
+		line, _ := bufio.NewReader(outR).ReadString('\n')
+		reply <- line
+	}()
+	select {
+	case line := <-reply:
+		if !strings.HasPrefix(line, `{"jsonrpc":"2.0","id":1,`) {
+			t.Fatalf("unexpected reply: %s", line)
+		}
+	case <-time.After(5 * time.Second):
+		t.Fatal("no reply while the next request was still partial")
+	}
+}
+
+// TestDebugf checks that per-message trace lines are written only when
+// CLOD_MCP_DEBUG enabled debug, as documented in the README.
+func TestDebugf(t *testing.T) {
+	oldStderr, oldDebug := os.Stderr, debug
+	t.Cleanup(func() { os.Stderr, debug = oldStderr, oldDebug })
+
+	for _, enabled := range []bool{false, true} {
+		r, w, err := os.Pipe()
+		if err != nil {
+			t.Fatalf("pipe: %v", err)
+		}
+		os.Stderr, debug = w, enabled
+		debugf("received method: %s", "tools/call")
+		_ = w.Close()
+		got, _ := io.ReadAll(r)
+		_ = r.Close()
+
+		want := ""
+		if enabled {
+			want = "[permbridge] received method: tools/call\n"
+		}
+		if string(got) != want {
+			t.Errorf("debug=%v: stderr = %q, want %q", enabled, got, want)
+		}
+	}
+}
+
+// TestDecisionResult covers the mapping from the bot's response line to
+// the tool result.
+func TestDecisionResult(t *testing.T) {
+	input := json.RawMessage(`{"command":"ls"}`)
+	cases := []struct {
+		name string
+		line string
+		want json.RawMessage
+	}{
+		{"allow", `{"behavior":"allow"}`, allowResult(input)},
+		{"deny with message", `{"behavior":"deny","message":"User bob denied permission"}`, denyResult("User bob denied permission")},
+		{"deny with extra field", `{"behavior":"deny","message":"nope","extra":true}`, denyResult("nope")},
+		{"deny without message", `{"behavior":"deny"}`, denyResult("Permission denied by user")},
+		{"unknown behavior", `{"behavior":"maybe","message":"huh"}`, denyResult("huh")},
+	}
+	for _, c := range cases {
+		t.Run(c.name, func(t *testing.T) {
+			got := decisionResult([]byte(c.line), input)
+			if string(got) != string(c.want) {
+				t.Errorf("decisionResult(%s)\n got: %s\nwant: %s", c.line, got, c.want)
+			}
+		})
+	}
+}
+
+// toolCallWorker starts runToolCalls once per test binary, as main does
+// once per process; a second worker would break prompt ordering.
+var toolCallWorker sync.Once
+
+// TestToolCallsQueued drives serve over pipes against a fake bot on a
+// real FIFO pair. While the first tools/call is held by the bot,
+// initialize and tools/list must still be answered; once released, the
+// calls must reach the bot and be answered in the order claude sent them.
+func TestToolCallsQueued(t *testing.T) {
+	dir := t.TempDir()
+	requestFIFO := filepath.Join(dir, fifoRequestName)
+	responseFIFO := filepath.Join(dir, fifoResponseName)
+	for _, p := range []string{requestFIFO, responseFIFO} {
+		if err := syscall.Mkfifo(p, 0600); err != nil {
+			t.Fatalf("mkfifo: %v", err)
+		}
+	}
+	oldPaths, oldStdout := fifoPaths, stdout
+	fifoPaths = func() (string, string) { return requestFIFO, responseFIFO }
+	outR, outW := io.Pipe()
+	stdout = bufio.NewWriter(outW)
+
+	// Response ids in the order they're written to stdout.
+	ids := make(chan string, 16)
+	go func() {
+		sc := bufio.NewScanner(outR)
+		for sc.Scan() {
+			var resp struct {
+				ID json.RawMessage `json:"id"`
+			}
+			if err := json.Unmarshal(sc.Bytes(), &resp); err != nil {
+				t.Errorf("bad response %s: %v", sc.Bytes(), err)
+				continue
+			}
+			ids <- string(resp.ID)
+		}
+	}()
+
+	// The fake bot: reads requests in order, holds the first until
+	// release is closed, and allows everything.
+	prompts := make(chan string, 16)
+	release := make(chan struct{})
+	releaseOnce := sync.OnceFunc(func() { close(release) })
+	go func() {
+		f, err := os.OpenFile(requestFIFO, os.O_RDONLY, 0)
+		if err != nil {
+			t.Errorf("open request FIFO: %v", err)
+			return
+		}
+		defer f.Close()
+		sc := bufio.NewScanner(f)
+		for first := true; sc.Scan(); first = false {
+			var req bridgeRequest
+			if err := json.Unmarshal(sc.Bytes(), &req); err != nil {
+				t.Errorf("bad request %s: %v", sc.Bytes(), err)
+				return
+			}
+			prompts <- req.ToolName
+			if first {
+				<-release
+			}
+			w, err := os.OpenFile(responseFIFO, os.O_WRONLY, 0)
+			if err != nil {
+				t.Errorf("open response FIFO: %v", err)
+				return
+			}
+			_, _ = w.Write([]byte(`{"behavior":"allow"}` + "\n"))
+			_ = w.Close()
+		}
+	}()
+
+	inR, inW := io.Pipe()
+	served := make(chan struct{})
+	toolCallWorker.Do(func() { go runToolCalls() })
+	go func() {
+		serve(inR)
+		close(served)
+	}()
+	t.Cleanup(func() {
+		_ = inW.Close()
+		<-served
+		bridge.mu.Lock()
+		bridge.reset()
+		bridge.mu.Unlock()
+		fifoPaths, stdout = oldPaths, oldStdout
+		_ = outW.Close()
+	})
+	// Registered last so it runs first: on failure the bot may still be
+	// holding the first prompt, and bridge.mu along with it.
+	t.Cleanup(releaseOnce)
+
+	send := func(line string) {
+		t.Helper()
+		if _, err := io.WriteString(inW, line+"\n"); err != nil {
+			t.Fatalf("write stdin: %v", err)
+		}
+	}
+	recv := func(ch chan string, what string) string {
+		t.Helper()
+		select {
+		case v := <-ch:
+			return v
+		case <-time.After(5 * time.Second):
+			t.Fatalf("timed out waiting for %s", what)
+			return ""
+		}
+	}
+
+	for i := 1; i <= 3; i++ {
+		send(fmt.Sprintf(`{"jsonrpc":"2.0","id":%d,"method":"tools/call","params":{"name":"request_permission","arguments":{"tool_name":"t%d","input":{}}}}`, i, i))
+	}
+	if got := recv(prompts, "first prompt"); got != "t1" {
+		t.Fatalf("first prompt = %s, want t1", got)
+	}
+
+	send(`{"jsonrpc":"2.0","id":10,"method":"initialize","params":{}}`)
+	send(`{"jsonrpc":"2.0","id":11,"method":"tools/list"}`)
+	for _, want := range []string{"10", "11"} {
+		if got := recv(ids, "response "+want); got != want {
+			t.Fatalf("response id = %s while tools/call pending, want %s", got, want)
+		}
+	}
+
+	releaseOnce()
+	for _, want := range []string{"t2", "t3"} {
+		if got := recv(prompts, "prompt "+want); got != want {
+			t.Errorf("prompt = %s, want %s", got, want)
+		}
+	}
+	for _, want := range []string{"1", "2", "3"} {
+		if got := recv(ids, "response "+want); got != want {
+			t.Errorf("response id = %s, want %s", got, want)
+		}
+	}
+}
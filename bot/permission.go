@@ -258,14 +258,14 @@ func (p *PermissionFIFO) readRequests(ctx context.Context) {
 
 		scanner := bufio.NewScanner(file)
 		for scanner.Scan() {
-			line := scanner.Text()
-			if line == "" {
+			line := scanner.Bytes()
+			if len(line) == 0 {
 				continue
 			}
 
 			var req PermissionRequest
-			if err := json.Unmarshal([]byte(line), &req); err != nil {
-				p.logger.Error().Err(err).Str("line", line).Msg("failed to parse permission request")
+			if err := json.Unmarshal(line, &req); err != nil {
+				p.logger.Error().Err(err).Bytes("line", line).Msg("failed to parse permission request")
 				continue
 			}
 